@@ -40,6 +40,10 @@ MENUS = {
                              Back""",
 }
 
+# Menu entries split into lines once at import, used by print_menu
+_MENU_ENTRIES = {menu: tuple(entry.strip() for entry in entries.split("\n"))
+                 for menu, entries in MENUS.items()}
+
 
 ###############################################################################
 # User Interaction
@@ -63,13 +67,13 @@ def print_welcome_message():
 
 
 def print_menu(menu):
-    """ Prints a menu from global variable MENUS
+    """ Prints a menu from global variable MENUS (via _MENU_ENTRIES)
     """
     heading = f"{menu} MENU"
     print("\n\n" + heading)
     print("="* len(heading) + "\n")
 
-    entries = [entry.strip() for entry in MENUS[menu].split("\n")]
+    entries = _MENU_ENTRIES[menu]
     for k, v in enumerate(entries, 1):
         print(f"  ({k}) {v}")
     print()
@@ -13,13 +13,75 @@ Date: 2023-11-12
 """
 
 
-import collections
-import csv
+import dataclasses
+import functools
+import io
+import re
+
+import numpy as np
 
 import Dobby_celestial_mechanics as cmech
 
 
-Star = collections.namedtuple("Star", "Rank, Name, Beyer, Mag_v, RA, DEC, Alt, Az")
+@dataclasses.dataclass(slots=True, frozen=True)
+class Star:
+    """ Record of a single star. Only built on demand from a StarTable, e.g.
+    for stars that are printed or used for alignment.
+    """
+    Rank: int
+    Name: str
+    Beyer: str
+    Mag_v: float
+    RA: float
+    DEC: float
+    Alt: float
+    Az: float
+    X: float
+    Y: float
+    Z: float
+
+
+@dataclasses.dataclass(eq=False)
+class StarTable:
+    """ List of stars stored as a structure of arrays, i.e. one NumPy array per
+    field. Indexing with an integer returns the corresponding Star.
+    """
+    rank: np.ndarray
+    name: np.ndarray # dtype=object
+    beyer: np.ndarray # dtype=object
+    mag: np.ndarray
+    ra: np.ndarray
+    dec: np.ndarray
+    alt: np.ndarray
+    az: np.ndarray
+    x: np.ndarray # cartesian direction cosines, computed once from (alt, az)
+    y: np.ndarray
+    z: np.ndarray
+
+    def __len__(self):
+        return len(self.rank)
+
+    @functools.cached_property
+    def positions(self):
+        """ (N, 3) array of the cartesian position vectors of all stars,
+        built once from x, y, z and shared by all triangle/angle calculations
+        """
+        positions = np.column_stack((self.x, self.y, self.z))
+        positions.flags.writeable = self.x.flags.writeable
+        return positions
+
+    def __getitem__(self, i):
+        return Star(int(self.rank[i]), self.name[i], self.beyer[i],
+                    float(self.mag[i]), float(self.ra[i]), float(self.dec[i]),
+                    float(self.alt[i]), float(self.az[i]),
+                    float(self.x[i]), float(self.y[i]), float(self.z[i]))
+
+    def subset(self, index):
+        """ Returns a new StarTable with the stars selected by an index array
+        or boolean mask
+        """
+        return StarTable(*(getattr(self, field.name)[index]
+                           for field in dataclasses.fields(self)))
 
 
 # Input file contains 48 brightest stars (according to Hipparcos project) with
@@ -30,8 +92,17 @@ INPUT_FILE = "48_Brightest_Stars_Hipparcos.csv"
 # e.g. due to limited visibility (houses, trees, etc.) or atmospheric seeing
 LOW_ANGLE = 20.0
 
-# Global variable that contains the list of bright stars
-star_list = list()
+# Regular expression for one line of the input file, e.g.
+# 1,Sirius,9 Alp CMa,-1.44,06h:45m:08.9s,-16deg:42am:58as
+# RA and DEC are split into their components, so that the whole file can be
+# parsed in one np.fromregex call without per-line converters.
+_STAR_LINE = re.compile(r"^(\d+),([^,]*),([^,]*),([-+\d.]+),"
+                        r"(\d+)h:(\d+)m:([\d.]+)s,"
+                        r"([-+]?)(\d+)deg:(\d+)am:([\d.]+)as\s*$", re.MULTILINE)
+
+_STAR_DTYPE = [("Rank", int), ("Name", "U32"), ("Beyer", "U32"), ("Mag_v", float),
+               ("RA_h", float), ("RA_m", float), ("RA_s", float),
+               ("DEC_sign", "U1"), ("DEC_d", float), ("DEC_m", float), ("DEC_s", float)]
 
 
 ###############################################################################
@@ -40,32 +111,60 @@ star_list = list()
 
 def load_bright_stars(fname = INPUT_FILE):
     """ Loads input file with bright star positions, converts (RA, DEC) positions
-    to (Alt, Az), and adds them to the global variable star_list as Star namedtuples
+    to (Alt, Az) for all stars in one batch, and returns them as a
+    StarTable. The result is cached for the current time and place, so the
+    file is only parsed again after these have been changed. The arrays of
+    the returned table are read-only; use subset() to get a modifiable copy.
+    """
+    return _load_bright_stars_cached(fname, cmech.YEAR, cmech.MONTH, cmech.DAY,
+                                     cmech.HOURS, cmech.MINUTES, cmech.SECONDS,
+                                     cmech.UT_COR, cmech.LAT, cmech.LONG)
+
+
+def _read_star_file(fname):
+    """ Parses the input file into a structured array of type _STAR_DTYPE.
+    The header line is skipped, and a ValueError is raised for any data line
+    that does not match _STAR_LINE, so that no star is silently lost.
+    """
+    with open(fname, encoding="utf-8") as infile:
+        lines = [line for line in infile.read().splitlines()[1:] if line.strip()]
+
+    data = np.fromregex(io.StringIO("\n".join(lines)), _STAR_LINE, dtype=_STAR_DTYPE)
+    if len(data) != len(lines):
+        bad = next(line for line in lines if not _STAR_LINE.match(line))
+        raise ValueError(f"{fname}: cannot parse line {bad!r}")
+
+    return data
+
+
+@functools.lru_cache(maxsize=8)
+def _load_bright_stars_cached(fname, year, month, day, hours, minutes, seconds,
+                              ut_cor, lat, long):
+    """ Does the work of load_bright_stars for a given time and place
     """
-    global star_list # allows this function to change the global variable
-
-    days_J2000 = days_from_J2000(YEAR, MONTH, DAY, HOURS + UT_COR, MINUTES, SECONDS)
-    lst = local_siderial_time(days_J2000, LONG,
-                              HMS_to_decimal_time(HOURS + UT_COR, MINUTES, SECONDS))
-
-    with open(fname) as csvfile:
-        reader = csv.reader(csvfile, delimiter=",")
-        for line in reader:
-            if line[0] == "Rank":
-                continue
-            else:
-                rank = int(line[0])
-                name = line[1]
-                beyer = line[2]
-                mag = float(line[3])
-                ra = RAStr2RA(line[4])
-                dec = DECStr2DEC(line[5])
-                ha = hour_angle(ra, lst)
-                Alt, Az = RA_DEC_to_ALT_AZ(ra, dec, ha, LAT)
-                current = Star(rank, name, beyer, mag, ra, dec, Alt, Az)
-                all_stars.append(current)
-
-    return all_stars
+    ut_hours = hours + ut_cor
+    days_J2000 = cmech.days_from_J2000(year, month, day, ut_hours, minutes, seconds)
+    lst = cmech.local_siderial_time(days_J2000, long,
+            cmech.HMS_to_decimal_time(ut_hours, minutes, seconds))
+
+    data = _read_star_file(fname)
+    ra = cmech.HMS_to_RA(data["RA_h"], data["RA_m"], data["RA_s"])
+    dec = cmech.DMS_to_DEC(np.where(data["DEC_sign"] == "-", -1.0, 1.0),
+                           data["DEC_d"], data["DEC_m"], data["DEC_s"])
+
+    alt, az = cmech.RA_DEC_to_ALT_AZ_batch(ra, dec, lst, lat)
+
+    x, y, z = cmech.cartesian_batch(alt, az)
+
+    stars = StarTable(data["Rank"], data["Name"].astype(object),
+                      data["Beyer"].astype(object), data["Mag_v"], ra, dec,
+                      alt, az, x, y, z)
+
+    # the cached table is shared by all callers, so it must not be changed
+    for field in dataclasses.fields(stars):
+        getattr(stars, field.name).flags.writeable = False
+
+    return stars
 
 
 def best_stars(stars):
@@ -73,82 +172,74 @@ def best_stars(stars):
     triangle that the stars span on the sky.
     """
     NUMBER = 15
-    triples = dict()
 
-    for i,j,k in itertools.combinations(range(len(stars)), 3):
-        triples[(i,j,k)] = area(stars[i], stars[j], stars[k])
+    if len(stars) < 3:
+        print("\n### At least three stars are required for alignment.")
+        return None
 
-    triples_sorted = sorted(triples.items(), key = lambda tr:tr[1], reverse = True)
+    i, j, k = cmech.triple_indices(len(stars))
+    areas = cmech.area_batch(stars.positions, i, j, k)
 
-    heading = f"{NUMBER} best suited triples out of {len(triples_sorted)} combinations:"
+    # only the NUMBER largest areas are needed, so avoid a full sort
+    number = min(NUMBER, len(areas))
+    top = np.argpartition(-areas, number - 1)[:number]
+    top = top[np.argsort(-areas[top])]
+
+    heading = f"{number} best suited triples out of {len(areas)} combinations:"
     print("\n" + heading)
     print()
 
-    index = 1
-    for triple in triples_sorted:
-        txt = f"{stars[triple[0][0]].Name:<15} {stars[triple[0][1]].Name:<15}" + \
-              f"{stars[triple[0][2]].Name:<15} area: {triple[1]:>5.3f}"
+    for index, t in enumerate(top, 1):
+        txt = f"{stars.name[i[t]]:<15} {stars.name[j[t]]:<15}" + \
+              f"{stars.name[k[t]]:<15} area: {areas[t]:>5.3f}"
         print(f" {index:>2d}. ", end="")
         print(txt)
 
-        index += 1
-        if index > NUMBER:
-            break
-
     return None
 
 
 def get_suitable_stars():
-    """ Returns a list of currently visible bright stars. Stars that are low in
-    the sky, i.e. below 20° altitude, are not included, even if they are
-    visible from the observation site.
+    """ Returns a StarTable of currently visible bright stars, sorted by
+    decreasing altitude. Stars that are low in the sky, i.e. below 20°
+    altitude, are not included, even if they are visible from the observation
+    site.
     """
     all_stars = load_bright_stars(INPUT_FILE)
-    suitable = list()
-
-    for star in all_stars:
-        if star.Alt >= LOW_ANGLE:
-            suitable.append(star)
 
-    sorted_stars = sorted(suitable, key = lambda s:s.Alt, reverse = True)
+    mask = all_stars.alt >= LOW_ANGLE
+    order = np.nonzero(mask)[0][np.argsort(-all_stars.alt[mask])]
 
-    return sorted_stars # suitable
+    return all_stars.subset(order)
 
 
 def print_star_list(stars, description):
-    """ Print a list of stars with their full information set
+    """ Print a StarTable of stars with their full information set
     """
     heading = f"\n\nList of {description} ({len(stars)}):"
     print(heading)
     print("=" * (len(heading)-2))
 
-    print(f"\nDate: {YEAR:4d}-{MONTH:02d}-{DAY:02d}, local time:",
-          f"{HOURS:02d}:{MINUTES:02d}:{SECONDS:02d} (UT+{-UT_COR}h),",
-          f"position: {LAT:>5.2f}°", end="")
-    if LAT >= 0.0:
+    print(f"\nDate: {cmech.YEAR:4d}-{cmech.MONTH:02d}-{cmech.DAY:02d}, local time:",
+          f"{cmech.HOURS:02d}:{cmech.MINUTES:02d}:{cmech.SECONDS:02d} (UT+{-cmech.UT_COR}h),",
+          f"position: {cmech.LAT:>5.2f}°", end="")
+    if cmech.LAT >= 0.0:
         print("N", end="")
     else:
         print("S", end="")
-    print(f" / {LONG:>5.2f}°", end="")
-    if LONG >= 0.0:
+    print(f" / {cmech.LONG:>5.2f}°", end="")
+    if cmech.LONG >= 0.0:
         print("E\n")
     else:
         print("W\n")
 
-    for star in stars:
-        if star.Alt <= 0.0:
-            continue
-        elif star.Alt < LOW_ANGLE:
-            print(" (", end="")
-            low += 1
-        else:
-            print("  ", end="")
-        print(f"{star.Name:<15} {star.Beyer:>11}     {star.Mag_v:5.2f} mag    ",
-              f"Az = {star.Az:>6.2f}° / Alt = {star.Alt:>5.2f}°", end="")
-        if star.Alt < 20.0:
-            print(")")
-        else:
-            print()
+    # stars below the horizon are skipped, low stars are put in parentheses
+    visible = np.nonzero(stars.alt > 0.0)[0]
+    low = stars.alt < LOW_ANGLE
 
-    return None
+    for i in visible:
+        print(" (" if low[i] else "  ", end="")
+        print(f"{stars.name[i]:<15} {stars.beyer[i]:>11}     {stars.mag[i]:5.2f} mag    ",
+              f"Az = {stars.az[i]:>6.2f}° / Alt = {stars.alt[i]:>5.2f}°", end="")
+        print(")" if low[i] else "")
 
+    return None
@@ -13,9 +13,19 @@ Date: 2023-11-12
 """
 
 
+import collections
 import datetime
+import functools
 import math
 
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError: # Numba is optional, NumPy is used as fallback
+    njit = None
+    prange = range
+
 
 TimePlace = collections.namedtuple("TimePlace",
         "Year, Month, Day, Hours, Minutes, Seconds, Latitude, Longitude")
@@ -54,22 +64,19 @@ DEFAULT = TimePlace(
 # Helper functions
 ###############################################################################
 
-def HMS_to_decimal_time(hours, minutes, seconds):
-    """ Converts hours, minutes, seconds to a time measured in fractional hours
-    """
-    return hours + minutes/60 + seconds/3600
-
-
-def rad2deg(angle):
-    """ Converts an angle from radians to degrees
+def _jit(**options):
+    """ Decorator that compiles a function with Numba, if available, and
+    leaves it unchanged otherwise
     """
-    return 180 * angle / math.pi
+    if njit is None:
+        return lambda func: func
+    return njit(**options)
 
 
-def deg2rad(angle):
-    """ Converts an angle from degrees to radians
+def HMS_to_decimal_time(hours, minutes, seconds):
+    """ Converts hours, minutes, seconds to a time measured in fractional hours
     """
-    return math.pi * angle / 180
+    return hours + minutes/60 + seconds/3600
 
 
 def deg2time(deg):
@@ -82,29 +89,45 @@ def deg2time(deg):
     return int(hours), int(minutes), int(seconds)
 
 
+def HMS_to_RA(hours, minutes, seconds):
+    """ Converts a right ascension given in hours, minutes and seconds to a
+    decimal angle, using the conversion 1 hr --> 15 deg. Works on scalars as
+    well as on NumPy arrays.
+    """
+    return (hours + minutes/60.0 + seconds/3600.0)*15.0
+
+
+def DMS_to_DEC(sign, deg, arcmin, arcsec):
+    """ Converts a declination given as sign (+1.0 or -1.0), unsigned degrees,
+    arcminutes and arcseconds to a decimal angle. Works on scalars as well as
+    on NumPy arrays.
+    """
+    return sign * (deg + arcmin/60.0 + arcsec/3600.0)
+
+
+# Translation table that removes the unit characters from RA/DEC strings like
+# "06h:45m:08.9s" or "-16deg:42am:58as"
+_STRIP_UNITS = str.maketrans("", "", "hmsdega°'\"")
+
+
 def RAStr2RA(RAStr):
     """ Converts an angle given in the format hours:minutes:seconds to a
     decimal angle, using the conversion 1 hr --> 15 deg
     """
-    tmp = RAStr.split(":")
-    h, m, s = float(tmp[0][:-1]), float(tmp[1][:-1]), float(tmp[2][:-1])
-    return (h + m/60.0 + s/3600.0)*15.0
+    h, m, s = RAStr.translate(_STRIP_UNITS).split(":")
+    return HMS_to_RA(float(h), float(m), float(s))
 
 
 def DECStr2DEC(DECStr):
     """ Converts an angle given as a string of degrees, arcminutes and arcseconds
     to a decimal angle. The sign of the angle is taken into account.
     """
-    tmp = DECStr.split(":")
-    deg = tmp[0][:-3]
-    arcmin = tmp[1][:-2]
-    arcsec = tmp[2][:-2]
-    if deg[0] == "-":
+    deg, arcmin, arcsec = DECStr.translate(_STRIP_UNITS).split(":")
+    if deg.lstrip()[0] == "-":
         multiplier = -1.0
-        deg = deg[1:]
     else:
         multiplier = 1.0
-    return multiplier * (float(deg) + float(arcmin)/60.0 + float(arcsec)/3600.0)
+    return DMS_to_DEC(multiplier, abs(float(deg)), float(arcmin), float(arcsec))
 
 
 def cartesian(star):
@@ -120,105 +143,180 @@ def cartesian(star):
     return x, y, z
 
 
+def cartesian_batch(alt, az):
+    """ Returns the positions of stars given by arrays of altitude and azimuth
+    angles (in degrees) in cartesian coordinates as three arrays x, y, z
+    """
+    Alt = np.deg2rad(alt)
+    Az = np.deg2rad(az)
+
+    x = np.cos(Alt) * np.cos(Az)
+    y = np.cos(Alt) * np.sin(Az)
+    z = np.sin(Alt)
+
+    return x, y, z
+
+
 def vector_product(v1, v2):
     """ Returns the vector product of two vectors in cartesian coordinates
     """
-    r0 = v1[1] * v2[2] - v1[2] * v2[1]
-    r1 = v1[2] * v2[0] - v1[0] * v2[2]
-    r2 = v1[0] * v2[1] - v1[1] * v2[0]
+    a0, a1, a2 = v1
+    b0, b1, b2 = v2
 
-    return r0, r1, r2
+    return a1*b2 - a2*b1, a2*b0 - a0*b2, a0*b1 - a1*b0
 
 
 def vector_norm(v):
-    """ Returns the cartesian norm of a vector
+    """ Returns the cartesian norm of a vector in three dimensions
+    """
+    return math.hypot(v[0], v[1], v[2])
+
+
+@_jit(cache=True, fastmath=True)
+def _area_kernel(x1, y1, z1, x2, y2, z2, x3, y3, z3):
+    """ Area of the planar triangle spanned by three points in cartesian
+    coordinates, with edges, cross product and norm inlined into a single
+    function that can be compiled with Numba
     """
-    sum_sq = 0
-    for component in v:
-        sum_sq += component**2
-    return math.sqrt(sum_sq)
+    ex1, ey1, ez1 = x1 - x2, y1 - y2, z1 - z2
+    ex2, ey2, ez2 = x1 - x3, y1 - y3, z1 - z3
 
+    cx = ey1*ez2 - ez1*ey2
+    cy = ez1*ex2 - ex1*ez2
+    cz = ex1*ey2 - ey1*ex2
 
-def area(s1, s2, s3):
+    return 0.5 * math.sqrt(cx*cx + cy*cy + cz*cz)
+
+
+def area(v1, v2, v3):
     """ Returns the area of the planar triangle created by the position vectors
-    of three stars s1, s2 and s3 on a sphere with unity radius
+    v1, v2 and v3 (in cartesian coordinates, e.g. (star.X, star.Y, star.Z)) of
+    three stars on a sphere with unity radius
     """
-    v1 = cartesian(s1)
-    v2 = cartesian(s2)
-    v3 = cartesian(s3)
+    return _area_kernel(v1[0], v1[1], v1[2], v2[0], v2[1], v2[2],
+                        v3[0], v3[1], v3[2])
+
 
-    edge1 = (v1[0]-v2[0], v1[1]-v2[1], v1[2]-v2[2])
-    edge2 = (v1[0]-v3[0], v1[1]-v3[1], v1[2]-v2[2])
+@functools.lru_cache(maxsize=4)
+def triple_indices(n):
+    """ Returns three index arrays i < j < k of all combinations of three out
+    of n objects in lexicographic order, like np.triu_indices does for pairs.
+    The read-only arrays are cached, since they only depend on n.
+    """
+    if n < 3:
+        indices = tuple(np.empty(0, dtype=np.intp) for _ in range(3))
+    else:
+        i, j, k = [], [], []
+        for first in range(n-2):
+            second, third = np.triu_indices(n - first - 1, 1)
+            i.append(np.full(len(second), first, dtype=np.intp))
+            j.append(second + first + 1)
+            k.append(third + first + 1)
 
-    area = 0.5 * vector_norm( vector_product(edge1, edge2) )
+        indices = tuple(np.concatenate(index) for index in (i, j, k))
 
-    return area
+    for index in indices:
+        index.flags.writeable = False
+
+    return indices
+
+
+# Number of triangles from which on area_batch uses the parallel Numba kernel.
+# Below, e.g. for the ~1000 triples of the suitable bright stars, the NumPy
+# path takes only milliseconds and the kernel would not pay off its start-up.
+_PARALLEL_MIN_TRIANGLES = 100000
+
+
+@_jit(cache=True, parallel=True, fastmath=True)
+def _area_batch_parallel(V, i, j, k):
+    """ Compiled, thread-parallel loop of _area_kernel over all triangles
+    given by the index arrays i, j and k
+    """
+    areas = np.empty(i.shape[0])
+    for t in prange(i.shape[0]):
+        a, b, c = i[t], j[t], k[t]
+        areas[t] = _area_kernel(V[a, 0], V[a, 1], V[a, 2], V[b, 0], V[b, 1], V[b, 2],
+                                V[c, 0], V[c, 1], V[c, 2])
+    return areas
+
+
+def area_batch(V, i, j, k):
+    """ Returns the areas of the planar triangles created by the position
+    vectors of stars on a sphere with unity radius, given as rows of the
+    (N, 3) array V. The triangles are given by the index arrays i, j and k.
+    Large batches run as a parallel Numba loop if Numba is installed, all
+    others as NumPy broadcast.
+    """
+    V = np.asarray(V, dtype=float)
+    i, j, k = (np.asarray(index, dtype=np.intp) for index in (i, j, k))
+    if not (i.ndim == 1 and i.shape == j.shape == k.shape):
+        raise ValueError("index arrays i, j and k must be 1-D and of equal length")
+
+    if njit is not None and len(i) >= _PARALLEL_MIN_TRIANGLES:
+        # the compiled kernel does no bounds checking, so check here as NumPy
+        # would, and map negative indices to positive ones
+        n = len(V)
+        lowest = min(index.min() for index in (i, j, k))
+        if lowest < -n or max(index.max() for index in (i, j, k)) >= n:
+            raise IndexError(f"triangle index out of range for {n} stars")
+        if lowest < 0:
+            i, j, k = (index % n for index in (i, j, k))
+        return _area_batch_parallel(np.ascontiguousarray(V), i, j, k)
+
+    edge1 = V[i] - V[j]
+    edge2 = V[i] - V[k]
+    cross = np.cross(edge1, edge2)
+
+    # row-wise dot product without a temporary (M, 3) array of squares
+    return 0.5 * np.sqrt(np.einsum("ij,ij->i", cross, cross))
 
 
 def angle(s1, s2):
-    """ Returns the angle between two stars s1, s2
+    """ Returns the angle between two stars s1, s2, computed from their
+    precomputed position vectors (X, Y, Z) as atan2 of the norm of the cross
+    product and the dot product. Unlike acos of the spherical law of cosines,
+    this stays accurate for small separations and for nearly opposite stars,
+    and it needs no trigonometry except the final atan2.
     """
-    alt1 = math.radians(s1.Alt)
-    az1 = math.radians(s1.Az)
+    v1 = (s1.X, s1.Y, s1.Z)
+    v2 = (s2.X, s2.Y, s2.Z)
 
-    alt2 = math.radians(s2.Alt)
-    az2 = math.radians(s2.Az)
+    sin_angle = vector_norm(vector_product(v1, v2))
+    cos_angle = v1[0]*v2[0] + v1[1]*v2[1] + v1[2]*v2[2]
 
-    cos_angle = math.cos(alt1)*math.cos(alt2)*math.cos(az1-az2) + \
-            math.sin(alt1)*math.sin(alt2)
+    return math.atan2(sin_angle, cos_angle)
 
-    return math.acos(cos_angle)
+
+def angle_matrix(V):
+    """ Returns the (N, N) matrix of angles between all pairs of stars whose
+    position vectors are given as rows of the (N, 3) array V. Like angle(),
+    the angles are computed as atan2 of the norm of the cross product and the
+    dot product of the position vectors.
+    """
+    cross = np.cross(V[:, np.newaxis, :], V[np.newaxis, :, :])
+    sin_angle = np.sqrt(np.einsum("ijk,ijk->ij", cross, cross))
+    cos_angle = V @ V.T
+
+    return np.arctan2(sin_angle, cos_angle)
 
 
 ###############################################################################
 # Time calculations
 ###############################################################################
 
-def days_from_J2000_until_year(year):
-    """ Returns the number of days from J2000 (January, 1st, 2000, 12 AM
-    on 0th meridian (i.e. 12AM UT)) until the beginning of the present year.
-    Takes into account whether the current year is a leap year or not.
-    """
-    return (year-1998)*365 + (year-1998+1)//4 - 731.5
-
-
-def days_until_month_begins(year, month):
-    """ Prints the number of days from the beginning of the year until
-    the beginning of the current month, e.g. 31 for February. Takes
-    into account whether the current year is a leap year or not.
-    """
-    DAYS_TIL_MONTH = {
-        1   : 0,
-        2   : 31,
-        3   : 59,
-        4   : 90,
-        5   : 120,
-        6   : 151,
-        7   : 181,
-        8   : 212,
-        9   : 243,
-        10  : 273,
-        11  : 304,
-        12  : 334
-    }
-    if year % 4 == 0 and month > 2:
-        return DAYS_TIL_MONTH[month] + 1
-    else:
-        return DAYS_TIL_MONTH[month]
+# Reference epoch J2000: January, 1, 2000, 12 AM UT
+_J2000 = datetime.datetime(2000, 1, 1, 12)
 
 
 def days_from_J2000(year, month, day, hours, minutes, seconds):
     """ Returns the number of days as a decimal fraction from J2000
-    (January, 1, 2000, 12 AM UT) until the specified time.
-    days1, days2, days3:
-    - #days from J2000 until the beginning of the specified year
-    - #days from the beginning of the year to the beginning of the specified day
-    - fraction that has passed of the specified day until the specified time
+    (January, 1, 2000, 12 AM UT) until the specified time, using the
+    Gregorian calendar of the datetime module. The time of day is added as a
+    timedelta, so hours may lie outside 0...23 after a time zone correction.
     """
-    days1 = days_from_J2000_until_year(year)
-    days2 = days_until_month_begins(year, month) + day
-    days3 = HMS_to_decimal_time(hours, minutes, seconds) / 24.0
-    return days1 + days2 + days3
+    delta = datetime.datetime(year, month, day) - _J2000 + \
+            datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+    return delta.total_seconds() / 86400.0
 
 
 def local_siderial_time(days_from_J2000, longitude, time):
@@ -234,32 +332,105 @@ def local_siderial_time(days_from_J2000, longitude, time):
 
 def hour_angle(RA, LST):
     """ Returns the hour angle of an object with right ascension RA at
-    local siderial time LST. HA and RA are measured in degrees.
+    local siderial time LST. HA and RA are measured in degrees. RA may also
+    be a NumPy array.
     """
     return (LST - RA) % 360
 
 
+@functools.lru_cache(maxsize=8)
+def _sin_cos_lat(latD):
+    """ Returns sine and cosine of latitude latD. Cached, as the latitude is
+    the same for all objects converted at one observation site.
+    """
+    return math.sin(math.radians(latD)), math.cos(math.radians(latD))
+
+
+def _ra_to_altaz(raD, decD, lst, sin_lat, cos_lat):
+    """ Converts (RA, DEC) to (ALT, AZ) at local siderial time lst for
+    precomputed sine and cosine of the latitude. Hour angle and coordinate
+    transformation are fused into one function, which is shared by
+    RA_DEC_to_ALT_AZ and the compiled batch kernel.
+    """
+    dec = math.radians(decD)
+    ha = math.radians((lst - raD) % 360.0) # hour_angle(raD, lst), inlined
+    sin_dec = math.sin(dec)
+    cos_dec = math.cos(dec)
+
+    cos_ha = math.cos(ha)
+
+    alt = math.asin(sin_dec * sin_lat + cos_dec * cos_lat * cos_ha)
+
+    # atan2 resolves the quadrant without a branch and, unlike acos, stays
+    # accurate close to the meridian
+    az = math.atan2(-cos_dec * math.sin(ha), sin_dec * cos_lat - cos_dec * sin_lat * cos_ha)
+
+    return math.degrees(alt), math.degrees(az) % 360.0
+
+
+_ra_to_altaz_jit = _jit(cache=True, fastmath=True)(_ra_to_altaz)
+
+
 def RA_DEC_to_ALT_AZ(raD, decD, haD, latD):
     """ Converts (RA, DEC) coordinates to (ALT, AZ) for a given hour angle
-    and latitude. All angles are measured in degrees.
+    and latitude. All angles are measured in degrees. Uses the Numba
+    compiled kernel if Numba is installed, e.g. for tracking single objects.
     """
-    dec = deg2rad(decD)
-    ha = deg2rad(haD)
-    lat = deg2rad(latD)
+    sin_lat, cos_lat = _sin_cos_lat(latD)
+    # HA = LST - RA, i.e. the hour angle is passed as LST of an object at RA = 0
+    return _ra_to_altaz_jit(0.0, float(decD), float(haD), sin_lat, cos_lat)
 
-    sin_alt = (math.sin(dec) * math.sin(lat)) + (math.cos(dec) * math.cos(lat) * math.cos(ha))
-    alt = math.asin(sin_alt)
 
-    cos_a = (math.sin(dec) - math.sin(alt) * math.sin(lat)) / (math.cos(alt) * math.cos(lat))
-    a = math.acos(cos_a)
+@_jit(cache=True)
+def _batch_radec(ra, dec, lst, sin_lat, cos_lat, out_alt, out_az):
+    """ Converts arrays of (RA, DEC) coordinates to (ALT, AZ) at local
+    siderial time lst and precomputed sine and cosine of the latitude, and
+    writes the results into the arrays out_alt and out_az
+    """
+    for n in range(ra.shape[0]):
+        out_alt[n], out_az[n] = _ra_to_altaz_jit(ra[n], dec[n], lst, sin_lat, cos_lat)
 
-    alt = rad2deg(alt)
-    if math.sin(ha) < 0:
-        az = rad2deg(a)
-    else:
-        az = 360 - rad2deg(a)
 
-    return alt, az
+def RA_DEC_to_ALT_AZ_vec(raD, decD, haD, latD):
+    """ Converts arrays of (RA, DEC) coordinates to arrays of (ALT, AZ) for
+    given hour angles and latitude with NumPy ufuncs. All angles are measured
+    in degrees.
+    """
+    sin_lat, cos_lat = _sin_cos_lat(latD)
+
+    dec, ha = np.deg2rad(decD), np.deg2rad(haD)
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+
+    cos_ha = np.cos(ha)
+
+    alt = np.arcsin(sin_dec*sin_lat + cos_dec*cos_lat*cos_ha)
+    az = np.arctan2(-cos_dec*np.sin(ha), sin_dec*cos_lat - cos_dec*sin_lat*cos_ha)
+
+    return np.rad2deg(alt), np.rad2deg(az) % 360
+
+
+def RA_DEC_to_ALT_AZ_batch(ra, dec, lst, latD):
+    """ Converts arrays of (RA, DEC) coordinates to arrays of (ALT, AZ) at
+    local siderial time lst and latitude latD. Uses the compiled Numba
+    kernel if Numba is installed and RA_DEC_to_ALT_AZ_vec otherwise. ra and
+    dec are broadcast against each other in both cases. All angles are
+    measured in degrees.
+    """
+    if njit is None:
+        return RA_DEC_to_ALT_AZ_vec(ra, dec, hour_angle(ra, lst), latD)
+
+    # broadcast like the NumPy path; the kernel loops over flat 1-D arrays
+    ra, dec = np.broadcast_arrays(np.asarray(ra, dtype=float),
+                                  np.asarray(dec, dtype=float))
+    shape = ra.shape
+
+    sin_lat, cos_lat = _sin_cos_lat(latD)
+    alt = np.empty(ra.size)
+    az = np.empty(ra.size)
+    _batch_radec(np.ascontiguousarray(ra).ravel(), np.ascontiguousarray(dec).ravel(),
+                 float(lst), sin_lat, cos_lat, alt, az)
+
+    return alt.reshape(shape), az.reshape(shape)
 
 
 def set_time_and_place():